@@ -2,10 +2,18 @@
 
 from __future__ import annotations
 
+import fnmatch
+import io
+import mmap
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
+from types import CodeType
+from typing import Iterator
 
 from openai import AzureOpenAI
 
@@ -14,12 +22,69 @@ load_dotenv(override=True)
 # File types that the agent is allowed to read/write.  Adjust as needed.
 CODE_EXTENSIONS = {".py", ".txt", ".md"}
 
+# Directories never worth snapshotting, pruned at any depth before descending.
+IGNORE_DIRS = {".git", ".venv", "__pycache__", "node_modules"}
+
+# Files at least this large are read through mmap instead of read(); below it
+# a single read() is cheaper than setting up and tearing down a mapping.
+MMAP_THRESHOLD = 1024 * 1024
+
+# Upper bound on threads used to read changed files in read_codebase.
+MAX_READ_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Maximum number of characters of the codebase snapshot sent to the model.
+MAX_SNAPSHOT_CHARS = 100_000
+
+# Contents of previously read files keyed by absolute path: (mtime_ns, size, text).
+# text is None for binary or non-UTF8 files, so they are not re-read until they change.
+_FILE_CACHE: dict[str, tuple[int, int, str | None]] = {}
+
+SYSTEM_PROMPT_PATH = Path(__file__).parent / "system_prompt.txt"
+GOAL_PATH = Path(__file__).parent / "goal.md"
+
+# Stripped contents of prompt files keyed by path: (mtime_ns, size, text).
+_TEXT_CACHE: dict[Path, tuple[int, int, str]] = {}
+
+
+def _read_cached(path: Path, default: str | None = None) -> str:
+    """Return the stripped text of a file, re-reading it only when it changed on disk."""
+    cached = _TEXT_CACHE.get(path)
+    try:
+        st = path.stat()
+        if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+            return cached[2]
+        text = path.read_text(encoding="utf-8").strip()
+    except (OSError, UnicodeDecodeError):
+        # Executed code may have moved, deleted or garbled the file; keep the last good copy
+        if cached is not None:
+            return cached[2]
+        if default is not None:
+            return default
+        raise
+    _TEXT_CACHE[path] = (st.st_mtime_ns, st.st_size, text)
+    return text
+
+
 # Load SYSTEM_PROMPT from prompt.txt
-SYSTEM_PROMPT = (Path(__file__).parent / "system_prompt.txt").read_text(encoding="utf-8").strip()
+SYSTEM_PROMPT = _read_cached(SYSTEM_PROMPT_PATH)
 
 
 # Load goal from goal.md
-GOAL = (Path(__file__).parent / "goal.md").read_text(encoding="utf-8").strip()
+GOAL = _read_cached(GOAL_PATH)
+
+
+@lru_cache(maxsize=1)
+def _compose_system_prompt(system_prompt: str, goal: str) -> str:
+    """Add GOAL to the system prompt."""
+    return f"{system_prompt}\n\n ================================== Current GOAL:\n{goal}"
+
+
+def _system_prompt_with_goal() -> str:
+    """Return the system message, picking up edits to the prompt files between steps."""
+    return _compose_system_prompt(
+        _read_cached(SYSTEM_PROMPT_PATH, SYSTEM_PROMPT),
+        _read_cached(GOAL_PATH, GOAL),
+    )
 
 
 def _read_gitignore(root: Path) -> list[str]:
@@ -37,78 +102,210 @@ def _read_gitignore(root: Path) -> list[str]:
     return patterns
 
 
-def _is_ignored(path: Path, root: Path, ignore_patterns: list[str]) -> bool:
-    """Check if a path is ignored by .gitignore rules."""
-    import fnmatch
-    rel_path = str(path.relative_to(root).as_posix())
+def _compile_ignore(ignore_patterns: list[str]) -> re.Pattern[str]:
+    """Compile .gitignore rules into a single regex matched against posix relative paths."""
+    alternatives = []
     for pattern in ignore_patterns:
+        # Handle patterns anchored to the root (e.g., "/build.log")
+        anchored = pattern.startswith('/')
+        if anchored:
+            pattern = pattern.lstrip('/')
+            if not pattern:
+                continue
         # Handle directory-only patterns (e.g., "node_modules/")
         if pattern.endswith('/'):
             # Match if the path starts with the directory pattern
-            if rel_path.startswith(pattern):
-                return True
+            alternatives.append(re.escape(pattern))
             # Also match against the pattern with a wildcard for files inside
-            if fnmatch.fnmatch(rel_path, pattern + '*'):
-                return True
-        # Handle patterns without slashes (e.g., "*.log")
-        elif '/' not in pattern:
-            if fnmatch.fnmatch(path.name, pattern):
-                return True
+            alternatives.append(fnmatch.translate(pattern + '*'))
+        # Handle patterns without slashes (e.g., "*.log"), matched against the file name
+        elif '/' not in pattern and not anchored:
+            alternatives.append(r"(?:.*/)?(?=[^/]*\Z)" + fnmatch.translate(pattern))
         # Handle patterns with slashes (e.g., "config/*.ini")
         else:
-            if fnmatch.fnmatch(rel_path, pattern):
-                return True
-    return False
+            alternatives.append(fnmatch.translate(pattern))
+    if not alternatives:
+        return re.compile(r"(?!)")
+    # fnmatch is case-insensitive on Windows; keep the same behaviour here.
+    flags = re.IGNORECASE if os.name == "nt" else 0
+    return re.compile("(?:" + "|".join(alternatives) + ")", flags)
 
 
-def read_codebase(root: Path) -> dict[str, str]:
-    """Return a dict mapping relative paths to file contents, respecting .gitignore."""
-    files: dict[str, str] = {}
-    ignore_patterns = _read_gitignore(root)
-    for path in root.rglob("*"):
-        if path.is_dir() or _is_ignored(path, root, ignore_patterns):
+def _is_ignored(rel_path: str, ignore: re.Pattern[str]) -> bool:
+    """Check if a posix relative path is ignored by the compiled .gitignore rules."""
+    return ignore.match(rel_path) is not None
+
+
+def _iter_code_files(root: Path, ignore: re.Pattern[str]) -> Iterator[tuple[str, os.DirEntry[str]]]:
+    """Yield (posix relative path, entry) for code files, pruning ignored directories."""
+    suffixes = tuple(CODE_EXTENSIONS)
+    stack = [("", str(root))]
+    while stack:
+        prefix, directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                # Sort so the snapshot (and what survives truncation) is deterministic
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            # Unreadable directory; skip it like rglob does
             continue
-        if path.suffix in CODE_EXTENSIONS and path.is_file():
+        subdirs = []
+        for entry in entries:
+            rel_path = prefix + entry.name
             try:
-                files[str(path.relative_to(root))] = path.read_text()
-            except UnicodeDecodeError:
-                # Skip binary or non‑UTF8 files
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in IGNORE_DIRS and not _is_ignored(rel_path + "/", ignore):
+                        subdirs.append((rel_path + "/", entry.path))
+                    continue
+                is_code_file = (
+                    entry.name.endswith(suffixes)
+                    # A bare ".py" has no suffix (as with Path.suffix), so it is not a code file
+                    and entry.name not in CODE_EXTENSIONS
+                    and entry.is_file()
+                    and not _is_ignored(rel_path, ignore)
+                )
+            except OSError:
+                # Entry vanished or cannot be inspected; skip only this entry
                 continue
+            if is_code_file:
+                yield rel_path, entry
+        # Visit subdirectories depth-first in listing order
+        stack.extend(reversed(subdirs))
+
+
+def _read_file(path: str) -> str:
+    """Read a UTF-8 file, mapping it into memory when it is large enough."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            text = f.read().decode("utf-8")
+        else:
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                if hasattr(mmap, "MADV_WILLNEED"):
+                    mm.madvise(mmap.MADV_WILLNEED)
+                text = str(mm, "utf-8")
+    # Translate newlines the way read_text() does (universal newlines)
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def _read_code_file(path: str) -> str | None:
+    """Read a code file, returning None for binary or non-UTF8 content."""
+    try:
+        return _read_file(path)
+    except UnicodeDecodeError:
+        return None
+
+
+def read_codebase(root: Path) -> dict[str, str]:
+    """Return a dict mapping relative paths to file contents, respecting .gitignore."""
+    files: dict[str, str] = {}
+    ignore = _compile_ignore(_read_gitignore(root))
+    candidates: list[tuple[str, str]] = []
+    stale: list[tuple[str, int, int]] = []
+    for rel_path, entry in _iter_code_files(root, ignore):
+        st = entry.stat()
+        cached = _FILE_CACHE.get(entry.path)
+        if cached is None or cached[:2] != (st.st_mtime_ns, st.st_size):
+            stale.append((entry.path, st.st_mtime_ns, st.st_size))
+        candidates.append((rel_path, entry.path))
+    if stale:
+        # Read changed files concurrently; the GIL is released while waiting on I/O
+        with ThreadPoolExecutor(max_workers=min(MAX_READ_WORKERS, len(stale))) as pool:
+            contents = pool.map(_read_code_file, [path for path, _, _ in stale])
+            for (path, mtime_ns, size), content in zip(stale, contents):
+                _FILE_CACHE[path] = (mtime_ns, size, content)
+    # Drop files that were deleted, renamed or pruned since the last walk
+    seen = {path for _, path in candidates}
+    for path in _FILE_CACHE.keys() - seen:
+        del _FILE_CACHE[path]
+    for rel_path, path in candidates:
+        content = _FILE_CACHE[path][2]
+        # Skip binary or non‑UTF8 files
+        if content is not None:
+            files[rel_path.replace("/", os.sep)] = content
     return files
 
+
+def _format_snapshot(snapshot: dict[str, str], limit: int) -> str:
+    """Render the snapshot as "## path" blocks, stopping once ``limit`` characters are written."""
+    buf = io.StringIO()
+    remaining = limit
+    sep = ""
+    for p, c in snapshot.items():
+        for part in (sep, "## ", p, "\n", c):
+            if len(part) >= remaining:
+                buf.write(part[:remaining])
+                return buf.getvalue()
+            buf.write(part)
+            remaining -= len(part)
+        sep = "\n"
+    return buf.getvalue()
+
+
+def _extract_code(reply: str) -> tuple[str, CodeType | None]:
+    """Return the executable part of a reply and its code object, or None if it does not compile."""
+    try:
+        return reply, compile(reply, "<string>", "exec")
+    except (SyntaxError, ValueError):
+        pass
+    # The model sometimes wraps its code in ```python ... ``` or adds prose around it
+    start = reply.find("```")
+    if start == -1:
+        return reply, None
+    body_start = reply.find("\n", start)
+    if body_start == -1:
+        return reply, None
+    end = reply.find("```", body_start)
+    if end == -1:
+        return reply, None
+    code = reply[body_start + 1:end]
+    try:
+        return code, compile(code, "<string>", "exec")
+    except (SyntaxError, ValueError):
+        return code, None
+
+
+@lru_cache(maxsize=1)
+def _client() -> AzureOpenAI:
+    """Return the shared Azure OpenAI client, created on first use."""
+    return AzureOpenAI(
+        api_key=os.getenv("AZURE_KEY"),
+        azure_endpoint=os.getenv("AZURE_ENDPOINT"),
+        api_version="2025-03-01-preview",
+    )
+
+
 def agent_step(root: Path, model: str = "o3") -> None:
     """Run one reasoning / coding cycle."""
     snapshot = read_codebase(root)
     # Truncate to avoid blowing past context limits
-    joined = "\n".join(f"## {p}\n{c}" for p, c in snapshot.items())[:100000]
+    joined = _format_snapshot(snapshot, MAX_SNAPSHOT_CHARS)
 
     user_prompt = (
         f"Today is {datetime.now(timezone.utc).date()}.\n"
         f"Here is the current codebase (truncated):\n{joined}"
     )
 
-    # Add GOAL to the system prompt
-    SYSTEM_PROMPT_WITH_GOAL = f"{SYSTEM_PROMPT}\n\n ================================== Current GOAL:\n{GOAL}"
-
-    client = AzureOpenAI(
-            api_key=os.getenv("AZURE_KEY"),
-            azure_endpoint=os.getenv("AZURE_ENDPOINT"),
-            api_version="2025-03-01-preview",
-        )
+    client = _client()
 
     response = client.chat.completions.create(
         model=model,
         messages=[
-            {"role": "system", "content": SYSTEM_PROMPT_WITH_GOAL},
+            {"role": "system", "content": _system_prompt_with_goal()},
             {"role": "user", "content": user_prompt},
         ],
     )
 
-    reply = response.choices[0].message.content.strip()
+    reply, code = _extract_code(response.choices[0].message.content.strip())
     
     print("[AGENT] Executing code:\n" + reply)
     try:
-        exec(reply, globals())
+        # A reply that does not compile is exec'd as text so the SyntaxError is reported below
+        exec(code if code is not None else reply, globals())
     except Exception as e:
         print(f"[WARN] Error executing code: {e}")
 